@@ -5,26 +5,30 @@ from typing import List, Dict, Any, AsyncGenerator
 import os
 import logging
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter
-from openai import OpenAI
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from .embedding_utils import embed_text
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import (
+    Filter, FieldCondition, MatchValue, SearchRequest,
+    SearchParams, QuantizationSearchParams, PayloadSelectorInclude
+)
+from .embedding_utils import aembed_text, aclient, openai_semaphore
+from . import embedding_utils
 import json
 import asyncio
+import functools
 from .database import (
     get_user_by_email, create_user, create_document,
-    get_document_by_id, update_document, get_documents_for_user,
-    get_user_by_id
+    get_document_title, update_document,
+    get_documents_for_user, get_user_by_id
 )
 
 # Configure logging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format="%(message)s",
     datefmt="[%X]",
     handlers=[logging.StreamHandler()]
 )
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
@@ -38,34 +42,117 @@ EMBEDDING_MODEL = "text-embedding-3-small"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 REASONING_MODEL = "gpt-4o"
 
-# Initialize OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Micro-batching settings for Qdrant searches
+SEARCH_BATCH_SIZE = 16
+SEARCH_BATCH_WAIT = 0.005  # seconds
+SEARCH_MAX_INFLIGHT_BATCHES = 2
+
+# Payload keys are defined by the ingestion pipeline, so the full payload is returned
+# unless SEARCH_PAYLOAD_FIELDS (comma-separated) narrows it to the fields the LLM needs
+SEARCH_PAYLOAD_FIELDS = os.getenv("SEARCH_PAYLOAD_FIELDS")
+SEARCH_PAYLOAD = (
+    PayloadSelectorInclude(include=SEARCH_PAYLOAD_FIELDS.split(","))
+    if SEARCH_PAYLOAD_FIELDS else True
+)
 
-router = APIRouter()
+# Search with quantized vectors, then rescore the oversampled candidates with the originals
+SEARCH_PARAMS = SearchParams(
+    hnsw_ef=64,
+    quantization=QuantizationSearchParams(ignore=False, rescore=True, oversampling=2.0)
+)
 
-class ChatQuery(BaseModel):
-    query: str
-    document_id: str
-    filetype: str = "contract"
-    top_k: int = 3
+# Initialize Qdrant client once so its gRPC channel is shared across requests
+qdrant_client = AsyncQdrantClient(
+    url=QDRANT_URL,
+    api_key=QDRANT_API_KEY,
+    prefer_grpc=True,
+    timeout=60
+)
 
-class ChatResponse(BaseModel):
-    response: str
+class SearchBatcher:
+    """
+    Coalesces searches arriving within a few milliseconds into one search_batch call.
+    Like the shared Qdrant/OpenAI clients, it assumes a single long-lived event loop per worker.
+    """
+    def __init__(self, client: AsyncQdrantClient, collection_name: str,
+                 batch_size: int, max_wait: float, max_inflight: int):
+        self.client = client
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_inflight = max_inflight
+        self._queue = None
+        self._inflight = None
+        self._worker = None
+        self._tasks = set()
+        self._pending = set()
+
+    async def search(self, request: SearchRequest):
+        # Start the worker lazily so it runs on the server's event loop
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.add(future)
+        try:
+            await self._queue.put((request, future))
+            return await future
+        finally:
+            self._pending.discard(future)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.max_wait)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            # Bound the number of batches in flight against Qdrant
+            await self._inflight.acquire()
+            task = asyncio.create_task(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch):
+        try:
+            results = await self.client.search_batch(
+                collection_name=self.collection_name,
+                requests=[request for request, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._inflight.release()
+
+    async def close(self):
+        for task in [self._worker, *self._tasks]:
+            if task is not None:
+                task.cancel()
+        # Fail anything still waiting so callers don't hang on shutdown
+        for future in self._pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Search batcher is shut down"))
+        self._pending = set()
+        self._worker = None
+
+search_batcher = SearchBatcher(
+    qdrant_client,
+    COLLECTION_NAME,
+    batch_size=SEARCH_BATCH_SIZE,
+    max_wait=SEARCH_BATCH_WAIT,
+    max_inflight=SEARCH_MAX_INFLIGHT_BATCHES
+)
 
-async def stream_llm_response(query: str, search_results: List[Dict]):
-    """Stream the LLM response."""
-    try:
-        # Format the search results
-        formatted_results = []
-        for result in search_results:
-            formatted_results.append({
-                'id': result['id'],
-                'score': result['score'],
-                'payload': result['payload']
-            })
-
-        # Create the system and user prompts
-        system_prompt = """
+# System prompts are kept constant so the shared prefix hits OpenAI's prompt cache
+SYSTEM_PROMPT_STREAM = """
     You are a helpful, professional legal document analyzer assistant. You will be provided with some data in a json array format from a vector database and a user query.
     Your task is to analyze the data and provide a detailed and structured response.
     The data can be from an invoice, contract, purchase order, or any other legal document.
@@ -78,40 +165,7 @@ async def stream_llm_response(query: str, search_results: List[Dict]):
     You should not include any information about the database or the data source.
     """
 
-        user_prompt = f"""
-    Here is the data from the database:
-    {formatted_results}
-    Here is the query:
-    {query}
-    """
-
-        # Invoke the LLM with streaming
-        print("Invoking the LLM with system and user prompts for streaming.")
-        stream = client.chat.completions.create(
-            model=REASONING_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            stream=True
-        )
-
-        # Stream the response
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield f"data: {chunk.choices[0].delta.content}\n\n"
-
-    except Exception as e:
-        print(f"Error in streaming LLM response: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        yield f"data: Error: {str(e)}\n\n"
-
-def llm_query(data: List[Dict[str, Any]], query: str, filetype: str) -> str:
-    """
-    Function to query the LLM with the provided data from the qdrant db results.
-    """
-    system_prompt = f"""
+SYSTEM_PROMPT_SYNC = """
     You are a helpful, professional legal document analyzer assistant. You will be provided with some data in a json array format from a vector database and a user query.
     Your task is to analyze the data and provide a detailed and structured response.
     The data can be from an invoice, contract, purchase order, or any other legal document.
@@ -125,84 +179,158 @@ def llm_query(data: List[Dict[str, Any]], query: str, filetype: str) -> str:
     The response must be structured and not in markdown. 
     """
 
+router = APIRouter()
+
+class ChatQuery(BaseModel):
+    query: str
+    document_id: str
+    filetype: str = "contract"
+    top_k: int = 3
+
+class ChatResponse(BaseModel):
+    response: str
+
+def sse_event(data: str) -> str:
+    """Frame data as one SSE event; every line of the payload needs its own 'data: ' prefix."""
+    return "".join(f"data: {line}\n" for line in data.split("\n")) + "\n"
+
+async def stream_llm_response(query: str, search_results: List[Dict]):
+    """Stream the LLM response."""
+    # SSE comment so headers and the first bytes are flushed immediately
+    yield ": ping\n\n"
+    try:
+        # Create the user prompt; the system prompt is a constant so OpenAI can cache the prefix
+        results_json = json.dumps(search_results, default=str, separators=(",", ":"))
+        user_prompt = f"""
+    Here is the data from the database:
+    {results_json}
+    Here is the query:
+    {query}
+    """
+
+        # Invoke the LLM with streaming
+        logger.debug("Invoking the LLM with system and user prompts for streaming.")
+        # Hold the semaphore until the stream is consumed so long completions count
+        # against OPENAI_MAX_CONCURRENCY (a client disconnect closes the generator and releases it)
+        async with openai_semaphore:
+            stream = await aclient.chat.completions.create(
+                model=REASONING_MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT_STREAM},
+                    {"role": "user", "content": user_prompt}
+                ],
+                stream=True
+            )
+
+            # Stream the response without blocking the event loop
+            async for chunk in stream:
+                if chunk.choices[0].delta.content is not None:
+                    yield sse_event(chunk.choices[0].delta.content)
+
+    except Exception as e:
+        logger.error("Error in streaming LLM response: %s", e, exc_info=True)
+        yield sse_event(f"Error: {str(e)}")
+
+async def llm_query(data: List[Dict[str, Any]], query: str, filetype: str) -> str:
+    """
+    Function to query the LLM with the provided data from the qdrant db results.
+    """
+    data_json = json.dumps(data, default=str, separators=(",", ":"))
     user_prompt = f"""
     Here is the data from the database:
-    {data}
+    {data_json}
     Here is the query:
     {query}
     """
 
     try:
-        logging.debug("Invoking the LLM with system and user prompts.")
-        response = client.chat.completions.create(
-            model=REASONING_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-        )
-        logging.info("LLM query executed successfully.")
+        logger.debug("Invoking the LLM with system and user prompts.")
+        async with openai_semaphore:
+            response = await aclient.chat.completions.create(
+                model=REASONING_MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT_SYNC},
+                    {"role": "user", "content": user_prompt}
+                ],
+            )
+        logger.info("LLM query executed successfully.")
         return response.choices[0].message.content
     except Exception as e:
-        logging.error(f"Error invoking LLM: {e}", exc_info=True)
+        logger.error("Error invoking LLM: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-def generalized_query(query: str, document_id: str, filetype: str, top_k: int = 3) -> Dict[str, Any]:
+@functools.lru_cache(maxsize=10000)
+def filename_filter(filename: str) -> Filter:
+    """Build (once per filename) the Qdrant filter restricting a search to one document."""
+    return Filter(
+        must=[
+            FieldCondition(
+                key="filename",
+                match=MatchValue(value=filename)
+            )
+        ]
+    )
+
+async def close_clients():
+    """
+    Close the shared clients. Called from the application's lifespan on shutdown.
+    """
+    await search_batcher.close()
+    await qdrant_client.close()
+    await embedding_utils.close_clients()
+
+async def generalized_query(query: str, document_id: str, filetype: str, top_k: int = 3) -> Dict[str, Any]:
     """
     Perform a generalized search in the Qdrant collection and return the top results.
     """
     try:
-        logging.debug("Initializing Qdrant client.")
-        qdrant_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-
-        # Get the document from the database to get its filename
-        document = get_document_by_id(document_id)
-        if not document:
+        # Fetch the document title (its filename) and embed the query concurrently
+        logger.debug("Fetching the document title and generating embedding for the query.")
+        doc_task = asyncio.create_task(asyncio.to_thread(get_document_title, document_id))
+        emb_task = asyncio.create_task(aembed_text(query))
+        try:
+            filename, query_embedding = await asyncio.gather(doc_task, emb_task)
+        except Exception:
+            doc_task.cancel()
+            emb_task.cancel()
+            raise
+
+        if not filename:
             raise HTTPException(status_code=404, detail="Document not found")
 
-        filename = document['title']
         filename = filename.replace(".sfdt", ".docx")
-        print(f"filename  : {filename}")
-        logging.debug(f"Applying filter on filename: {filename}")
-        search_filter = Filter(
-            must=[
-                FieldCondition(
-                    key="filename",
-                    match=MatchValue(value=filename)
-                )
-            ]
+        logger.debug("Applying filter on filename: %s", filename)
+        search_filter = filename_filter(filename)
+
+        logger.debug("Performing search in the Qdrant collection.")
+        results = await search_batcher.search(
+            SearchRequest(
+                vector=query_embedding,
+                filter=search_filter,
+                limit=top_k,
+                with_payload=SEARCH_PAYLOAD,
+                with_vector=False,
+                params=SEARCH_PARAMS
+            )
         )
 
-        logging.debug("Generating embedding for the query.")
-        query_embedding = embed_text(query)
-
-        logging.debug("Performing search in the Qdrant collection.")
-        results = qdrant_client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=query_embedding,
-            limit=top_k,
-            with_payload=True,
-            query_filter=search_filter
-        )
+        logger.debug("Formatting the search results.")
+        formatted_results = [
+            {"id": result.id, "score": result.score, "payload": result.payload}
+            for result in results
+        ]
+        if logger.isEnabledFor(logging.DEBUG):
+            for result in formatted_results:
+                logger.debug("Processing result with ID: %s, Score: %s", result["id"], result["score"])
 
-        logging.debug("Formatting the search results.")
-        formatted_results = []
-        for result in results:
-            logging.debug(f"Processing result with ID: {result.id}, Score: {result.score}")
-            formatted_results.append({
-                "id": result.id,
-                "score": result.score,
-                "payload": result.payload,
-            })
-
-        logging.info("Query processed successfully.")
+        logger.info("Query processed successfully.")
         return {
             "query": query,
             "results": formatted_results,
         }
 
     except Exception as e:
-        logging.error(f"Error processing query: {e}", exc_info=True)
+        logger.error("Error processing query: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/chat", response_model=ChatResponse)
@@ -212,7 +340,7 @@ async def chat_endpoint(chat_query: ChatQuery):
     """
     try:
         # Run the vector query
-        vector_results = generalized_query(
+        vector_results = await generalized_query(
             query=chat_query.query,
             document_id=chat_query.document_id,
             filetype=chat_query.filetype,
@@ -220,7 +348,7 @@ async def chat_endpoint(chat_query: ChatQuery):
         )
 
         # Run the LLM query
-        llm_response = llm_query(
+        llm_response = await llm_query(
             data=vector_results['results'],
             query=chat_query.query,
             filetype=chat_query.filetype
@@ -229,7 +357,7 @@ async def chat_endpoint(chat_query: ChatQuery):
         return ChatResponse(response=llm_response)
 
     except Exception as e:
-        logging.error(f"Error in chat endpoint: {e}", exc_info=True)
+        logger.error("Error in chat endpoint: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/chat/stream")
@@ -239,7 +367,7 @@ async def chat_stream_endpoint(chat_query: ChatQuery):
     """
     try:
         # Run the vector query
-        vector_results = generalized_query(
+        vector_results = await generalized_query(
             query=chat_query.query,
             document_id=chat_query.document_id,
             filetype=chat_query.filetype,
@@ -252,9 +380,10 @@ async def chat_stream_endpoint(chat_query: ChatQuery):
                 query=chat_query.query,
                 search_results=vector_results['results']
             ),
-            media_type="text/event-stream"
+            media_type="text/event-stream",
+            headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"}
         )
 
     except Exception as e:
-        logging.error(f"Error in chat stream endpoint: {e}", exc_info=True)
+        logger.error("Error in chat stream endpoint: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List
 from datetime import datetime
@@ -7,6 +8,8 @@ from .database import db
 
 router = APIRouter()
 
+CLAUSE_FIELDS = ("title", "description", "domain", "created_at", "last_modified")
+
 class Clause(BaseModel):
     title: str
     description: str
@@ -21,18 +24,12 @@ class ClauseInDB(Clause):
 async def get_clauses(domain: str = None):
     try:
         query = {"domain": domain} if domain else {}
-        clauses = list(db.clauses.find(query))
-        return [
-            ClauseInDB(
-                id=str(clause["_id"]),
-                title=clause["title"],
-                description=clause["description"],
-                domain=clause["domain"],
-                created_at=clause["created_at"],
-                last_modified=clause["last_modified"]
-            )
+        clauses = db.clauses.find(query, {field: 1 for field in CLAUSE_FIELDS})
+        # Returning a response directly skips per-row ClauseInDB validation
+        return ORJSONResponse([
+            {"id": str(clause["_id"]), **{field: clause[field] for field in CLAUSE_FIELDS}}
             for clause in clauses
-        ]
+        ])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -56,8 +53,10 @@ async def create_clause(clause: Clause):
 @router.put("/clauses/{clause_id}", response_model=ClauseInDB)
 async def update_clause(clause_id: str, clause: Clause):
     try:
+        clause_oid = ObjectId(clause_id)
+
         # Check if clause exists
-        existing_clause = db.clauses.find_one({"_id": ObjectId(clause_id)})
+        existing_clause = db.clauses.find_one({"_id": clause_oid})
         if not existing_clause:
             raise HTTPException(status_code=404, detail="Clause not found")
 
@@ -69,12 +68,12 @@ async def update_clause(clause_id: str, clause: Clause):
             "last_modified": datetime.utcnow()
         }
         db.clauses.update_one(
-            {"_id": ObjectId(clause_id)},
+            {"_id": clause_oid},
             {"$set": update_data}
         )
 
         # Return updated clause
-        updated_clause = db.clauses.find_one({"_id": ObjectId(clause_id)})
+        updated_clause = db.clauses.find_one({"_id": clause_oid})
         return ClauseInDB(
             id=str(updated_clause["_id"]),
             title=updated_clause["title"],
@@ -89,13 +88,15 @@ async def update_clause(clause_id: str, clause: Clause):
 @router.delete("/clauses/{clause_id}")
 async def delete_clause(clause_id: str):
     try:
+        clause_oid = ObjectId(clause_id)
+
         # Check if clause exists
-        existing_clause = db.clauses.find_one({"_id": ObjectId(clause_id)})
+        existing_clause = db.clauses.find_one({"_id": clause_oid})
         if not existing_clause:
             raise HTTPException(status_code=404, detail="Clause not found")
 
         # Delete clause
-        result = db.clauses.delete_one({"_id": ObjectId(clause_id)})
+        result = db.clauses.delete_one({"_id": clause_oid})
         if result.deleted_count == 0:
             raise HTTPException(status_code=500, detail="Failed to delete clause")
 
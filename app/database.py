@@ -1,22 +1,57 @@
 from pymongo import MongoClient
+from cachetools import TTLCache
 from datetime import datetime, timedelta
 import os
+import logging
+import threading
+from .utils import encode_document_content
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
-client = MongoClient(MONGODB_URL)
+client = MongoClient(
+    MONGODB_URL,
+    maxPoolSize=100,
+    minPoolSize=10,
+    serverSelectionTimeoutMS=2000,
+    socketTimeoutMS=10000,
+    compressors="zstd,zlib",
+    retryWrites=True
+)
 db = client["document_review_db"]
 
 users_collection = db["users"]
 documents_collection = db["documents"]
 clauses_collection = db["clauses"]
 
+def ensure_indexes():
+    """Create the indexes backing the hot queries (no-op if they already exist)"""
+    indexes = [
+        (documents_collection, "reviewer_id", {}),
+        (documents_collection, "approvers", {}),
+        (documents_collection, [("status", 1), ("created_at", 1)], {}),
+        (clauses_collection, "domain", {}),
+        # Unique last: existing duplicate emails make this build fail
+        (users_collection, "email", {"unique": True}),
+    ]
+    # Create each index separately so one failure doesn't skip the rest
+    for collection, keys, options in indexes:
+        try:
+            collection.create_index(keys, **options)
+        except Exception as e:
+            logger.error("Error creating index %s on %s: %s", keys, collection.name, e)
+
+# Short-lived cache of document titles, which are read on every chat turn
+document_title_cache = TTLCache(maxsize=10000, ttl=60)
+document_title_cache_lock = threading.Lock()
+
 def update_document_status():
     """Update document status based on time and conditions"""
     # Update NEW to PENDING if more than 1 day has passed
-    one_day_ago = datetime.now() - timedelta(days=1)
+    one_day_ago = datetime.utcnow() - timedelta(days=1)
     documents_collection.update_many(
         {
             "status": "new",
@@ -31,27 +66,58 @@ def get_user_by_email(email: str):
 def get_user_by_id(user_id: str):
     return users_collection.find_one({"_id": user_id})
 
+def get_users_by_ids(user_ids: list, role: str = None, projection: dict = None):
+    query = {"_id": {"$in": user_ids}}
+    if role:
+        query["role"] = role
+    return list(users_collection.find(query, projection))
+
 def create_user(user_data: dict):
     return users_collection.insert_one(user_data)
 
 def create_document(document_data: dict):
+    # Store content base64-encoded so reads don't have to encode it
+    if document_data.get("content"):
+        document_data["content"] = encode_document_content(document_data["content"])
     return documents_collection.insert_one(document_data)
 
-def get_document_by_id(doc_id: str):
-    return documents_collection.find_one({"_id": doc_id})
+def get_document_by_id(doc_id: str, projection: dict = None):
+    return documents_collection.find_one({"_id": doc_id}, projection)
+
+def get_document_title(doc_id: str):
+    with document_title_cache_lock:
+        title = document_title_cache.get(doc_id)
+    if title is not None:
+        return title
+
+    document = documents_collection.find_one({"_id": doc_id}, {"title": 1})
+    if not document:
+        return None
+
+    with document_title_cache_lock:
+        document_title_cache[doc_id] = document["title"]
+    return document["title"]
 
 def update_document(doc_id: str, update_data: dict):
-    update_data["last_modified"] = datetime.now()
-    return documents_collection.update_one(
+    update_data["last_modified"] = datetime.utcnow()
+    if update_data.get("content"):
+        update_data["content"] = encode_document_content(update_data["content"])
+    result = documents_collection.update_one(
         {"_id": doc_id},
         {"$set": update_data}
     )
+    # Invalidate after the write so a concurrent read can't re-cache the old title
+    with document_title_cache_lock:
+        document_title_cache.pop(doc_id, None)
+    return result
 
 def get_documents_for_user(user_id: str, role: str):
+    # The list view doesn't need the (potentially large) document content
+    projection = {"content": 0}
     if role == "reviewer":
-        return list(documents_collection.find({"reviewer_id": user_id}))
+        return list(documents_collection.find({"reviewer_id": user_id}, projection))
     else:  # approver
-        return list(documents_collection.find({"approvers": user_id}))
+        return list(documents_collection.find({"approvers": user_id}, projection))
 
 def get_clauses(domain: str = None):
     query = {"domain": domain} if domain else {}
@@ -1,22 +1,147 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from redis import asyncio as aioredis
+from array import array
+from collections import OrderedDict
+import asyncio
+import hashlib
+import httpx
+import logging
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Embedding cache settings
+EMBEDDING_CACHE_SIZE = 4096
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+REDIS_URL = os.getenv("REDIS_URL")
+
+# OpenAI request settings
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "20"))
+OPENAI_MAX_RETRIES = 5
+
+# Initialize OpenAI clients once; they are shared by every request in the worker.
+# The SDK retries 429/5xx responses with exponential backoff.
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=OPENAI_MAX_RETRIES)
+aclient = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_retries=OPENAI_MAX_RETRIES,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=200,
+            max_keepalive_connections=200,
+            keepalive_expiry=30
+        )
+    )
+)
+
+# Bounds concurrent async OpenAI calls across the worker to stay under rate limits
+openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+# Optional shared cache for multi-worker deployments
+redis_client = aioredis.from_url(REDIS_URL) if REDIS_URL else None
+
+# In-process LRU cache keyed by (model, normalized text)
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+async def close_clients():
+    """
+    Close the shared OpenAI and Redis clients. Called on application shutdown.
+    """
+    client.close()
+    await aclient.close()
+    if redis_client is not None:
+        await redis_client.close()
+
+def _cache_key(text: str) -> tuple:
+    # The model is part of the key so switching models never serves stale vectors
+    return (EMBEDDING_MODEL, text.strip().lower())
+
+def _redis_key(key: tuple) -> str:
+    model, text = key
+    return f"emb:{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+def _cache_get(key: tuple):
+    with _embedding_cache_lock:
+        embedding = _embedding_cache.get(key)
+        if embedding is not None:
+            _embedding_cache.move_to_end(key)
+        return embedding
+
+def _cache_put(key: tuple, embedding: list):
+    with _embedding_cache_lock:
+        _embedding_cache[key] = embedding
+        _embedding_cache.move_to_end(key)
+        if len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
 
 def embed_text(text: str) -> list:
     """
     Generate embeddings for the given text using OpenAI's embedding model.
     """
+    key = _cache_key(text)
+    embedding = _cache_get(key)
+    if embedding is not None:
+        return embedding
+
     try:
         response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
+            model=EMBEDDING_MODEL,
+            input=key[1]
         )
-        return response.data[0].embedding
+        embedding = response.data[0].embedding
+    except Exception as e:
+        raise Exception(f"Error generating embeddings: {str(e)}")
+
+    _cache_put(key, embedding)
+    return embedding
+
+async def aembed_text(text: str) -> list:
+    """
+    Async variant of embed_text, for use inside request handlers.
+    Also consults Redis (when REDIS_URL is set) so workers share cached vectors.
+    """
+    key = _cache_key(text)
+    embedding = _cache_get(key)
+    if embedding is not None:
+        return embedding
+
+    if redis_client is not None:
+        try:
+            cached = await redis_client.get(_redis_key(key))
+            if cached is not None:
+                embedding = array("f", cached).tolist()
+                _cache_put(key, embedding)
+                return embedding
+        except Exception as e:
+            logger.warning("Error reading embedding cache: %s", e)
+
+    try:
+        async with openai_semaphore:
+            response = await aclient.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=key[1]
+            )
+        embedding = response.data[0].embedding
     except Exception as e:
-        raise Exception(f"Error generating embeddings: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Error generating embeddings: {str(e)}")
+
+    _cache_put(key, embedding)
+    if redis_client is not None:
+        try:
+            await redis_client.set(
+                _redis_key(key),
+                array("f", embedding).tobytes(),
+                ex=EMBEDDING_CACHE_TTL
+            )
+        except Exception as e:
+            logger.warning("Error writing embedding cache: %s", e)
+    return embedding
@@ -1,16 +1,23 @@
 from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, ORJSONResponse
 from datetime import timedelta
+from contextlib import asynccontextmanager
 import uuid
 from typing import List
 import os
-import base64
+import asyncio
+import binascii
+import logging
+import mimetypes
 import smtplib
+from urllib.parse import quote
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
 from pydantic import BaseModel
 from typing import Optional
 
@@ -18,19 +25,30 @@ from .models import User, Document, DocumentStatus, DocumentUpdate
 from .database import (
     get_user_by_email, create_user, create_document,
     get_document_by_id, update_document, get_documents_for_user,
-    get_user_by_id
+    get_user_by_id, get_users_by_ids, ensure_indexes
 )
 from .auth import (
     verify_password, get_password_hash, create_access_token,
     get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from .utils import encode_document_content, decode_document_content
 from . import clauses
 from . import ai_chat
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Index creation blocks on Mongo, so keep it out of import and off the event loop
+    await asyncio.to_thread(ensure_indexes)
+    yield
+    # Release pooled connections on shutdown
+    await ai_chat.close_clients()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Updated CORS middleware to use allow_origin_regex for dynamic origin matching
 app.add_middleware(
@@ -78,7 +96,10 @@ async def create_new_user(user: User):
     user_dict = user.dict()
     user_dict["password"] = hashed_password
     user_dict["_id"] = str(uuid.uuid4())
-    create_user(user_dict)
+    try:
+        create_user(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already registered")
     return {"message": "User created successfully"}
 
 @app.get("/documents/")
@@ -87,19 +108,9 @@ async def get_my_documents(
     current_user: dict = Depends(get_current_user)
 ):
     """Get all documents assigned to current user, optionally filtered by status"""
+    # Content is excluded from the list; fetch it via /documents/{id} or /documents/{id}/content
     documents = get_documents_for_user(str(current_user["_id"]), current_user["role"])
     
-    # Convert binary content to base64 for each document
-    for doc in documents:
-        if doc.get("content"):
-            try:
-                # If content is bytes, encode to base64
-                if isinstance(doc["content"], bytes):
-                    doc["content"] = base64.b64encode(doc["content"]).decode('utf-8')
-            except Exception as e:
-                print(f"Error encoding document content: {e}")
-                doc["content"] = None
-    
     if status:
         documents = [doc for doc in documents if doc["status"] == status]
     return documents
@@ -121,9 +132,10 @@ async def add_approvers(
         )
     
     # Verify all approver IDs exist and are actually approvers
+    found = get_users_by_ids(approver_ids, role="approver", projection={"_id": 1})
+    found_ids = {approver["_id"] for approver in found}
     for approver_id in approver_ids:
-        approver = get_user_by_id(approver_id)
-        if not approver or approver["role"] != "approver":
+        if approver_id not in found_ids:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Invalid approver ID: {approver_id}"
@@ -145,13 +157,12 @@ async def get_document(
         str(current_user["_id"]) not in document["approvers"]):
         raise HTTPException(status_code=403, detail="Not authorized to access this document")
     
-    # Convert binary content to base64
+    # Convert legacy binary content to base64 (new content is stored encoded)
     if document.get("content"):
         try:
-            if isinstance(document["content"], bytes):
-                document["content"] = base64.b64encode(document["content"]).decode('utf-8')
+            document["content"] = await asyncio.to_thread(encode_document_content, document["content"])
         except Exception as e:
-            print(f"Error encoding document content: {e}")
+            logger.error("Error encoding document content: %s", e)
             document["content"] = None
     
     # Update status to IN_PROGRESS if it's NEW or PENDING
@@ -160,6 +171,36 @@ async def get_document(
     
     return document
 
+@app.get("/documents/{document_id}/content")
+async def get_document_content(
+    document_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Download the raw document file without base64 wrapping"""
+    document = get_document_by_id(document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    if (str(current_user["_id"]) != document["reviewer_id"] and 
+        str(current_user["_id"]) not in document["approvers"]):
+        raise HTTPException(status_code=403, detail="Not authorized to access this document")
+    
+    if not document.get("content"):
+        raise HTTPException(status_code=404, detail="Document has no content")
+    
+    try:
+        content = await asyncio.to_thread(decode_document_content, document["content"])
+    except binascii.Error as e:
+        logger.error("Stored content for document %s is not valid base64: %s", document_id, e)
+        raise HTTPException(status_code=500, detail="Stored document content is corrupted")
+    # Titles may be .sfdt/.docx, which mimetypes may not know, so don't assume PDF
+    media_type = mimetypes.guess_type(document["title"])[0] or "application/octet-stream"
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={"Content-Disposition": f"inline; filename*=UTF-8''{quote(document['title'])}"}
+    )
+
 @app.put("/documents/{document_id}")
 async def update_document_status(
     document_id: str,
@@ -182,9 +223,9 @@ async def update_document_status(
                 "notes": update.notes
             }
             # Notify approvers (in a real system, this would send emails/notifications)
-            for approver_id in document["approvers"]:
-                approver = get_user_by_id(approver_id)
-                print(f"Notifying approver {approver['email']} that changes are ready for review")
+            approvers = get_users_by_ids(document["approvers"], projection={"email": 1})
+            for approver in approvers:
+                logger.info("Notifying approver %s that changes are ready for review", approver["email"])
         else:
             update_data = update.dict(exclude_unset=True)
     else:  # approver
@@ -193,7 +234,7 @@ async def update_document_status(
         
         if update.status == DocumentStatus.APPROVED:
             # Mock email sending
-            print(f"Document {document_id} approved and sent via email")
+            logger.info("Document %s approved and sent via email", document_id)
             update_data = {"status": update.status, "notes": update.notes}
         else:
             # Send back to reviewer with notes
@@ -220,11 +261,22 @@ async def get_user_by_email_endpoint(email: str):
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+def send_smtp_message(msg: MIMEMultipart):
+    """Send a message through Gmail SMTP (blocking; run it in a worker thread)"""
+    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
+        smtp.login(
+            os.getenv('SMTP_EMAIL', 'your-email@gmail.com'),
+            os.getenv('SMTP_PASSWORD', 'your-app-password')
+        )
+        smtp.send_message(msg)
+
 @app.post("/api/documents/send-email")
 async def send_email(request: EmailRequest):
     try:
-        # Get document from database
-        document = await get_document_by_id(request.document_id)
+        # Get document from database (pymongo is synchronous, so run it in a thread)
+        document = await asyncio.to_thread(
+            get_document_by_id, request.document_id, {"title": 1, "content": 1}
+        )
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
 
@@ -238,8 +290,10 @@ async def send_email(request: EmailRequest):
         msg.attach(MIMEText(request.message, 'plain'))
 
         # Add document as attachment
+        # Attach the decoded file bytes; MIMEApplication base64-encodes them once
         if document.get('content'):
-            attachment = MIMEApplication(document['content'].encode())
+            content = await asyncio.to_thread(decode_document_content, document['content'])
+            attachment = MIMEApplication(content)
             attachment.add_header(
                 'Content-Disposition',
                 'attachment',
@@ -247,16 +301,13 @@ async def send_email(request: EmailRequest):
             )
             msg.attach(attachment)
 
-        # Send email
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            smtp.login(
-                os.getenv('SMTP_EMAIL', 'your-email@gmail.com'),
-                os.getenv('SMTP_PASSWORD', 'your-app-password')
-            )
-            smtp.send_message(msg)
+        # Send email without blocking the event loop
+        await asyncio.to_thread(send_smtp_message, msg)
 
         return {"message": "Email sent successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -273,4 +324,12 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Multiple workers need an import string; run with `python -m app.main`
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", min(os.cpu_count() or 1, 4)))
+    )
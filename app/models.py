@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from enum import Enum
 
 class UserRole(str, Enum):
@@ -19,7 +19,7 @@ class User(BaseModel):
     email: EmailStr
     password: str
     role: UserRole
-    created_at: datetime = datetime.now()
+    created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Document(BaseModel):
     id: str
@@ -28,8 +28,8 @@ class Document(BaseModel):
     reviewer_id: str
     approvers: List[str] = []
     status: DocumentStatus = DocumentStatus.NEW
-    created_at: datetime = datetime.now()
-    last_modified: datetime = datetime.now()
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_modified: datetime = Field(default_factory=datetime.utcnow)
     notes: Optional[str] = None
     last_reviewed_by: Optional[str] = None
     changes_summary: Optional[str] = None
@@ -0,0 +1,14 @@
+import base64
+
+def encode_document_content(content):
+    """Return document content as a base64 string, encoding raw bytes if needed"""
+    if isinstance(content, bytes):
+        return base64.b64encode(content).decode('utf-8')
+    return content
+
+def decode_document_content(content) -> bytes:
+    """Return the raw file bytes for stored (base64 or legacy binary) content"""
+    if isinstance(content, bytes):
+        return content
+    # validate=True so non-base64 input raises instead of decoding to garbage
+    return base64.b64decode(content, validate=True)